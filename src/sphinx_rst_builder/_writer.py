@@ -6,7 +6,7 @@
 
 from __future__ import (print_function, unicode_literals, absolute_import)
 
-import inspect
+import itertools
 import os
 import sys
 import re
@@ -22,6 +22,51 @@ from sphinx.writers.text import TextTranslator, MAXWIDTH, STDINDENT
 
 _log = logging.getLogger("sphinx_rst_builder.writer")
 
+# inline markup emitted by many visitors
+_STRONG = sys.intern('**')
+_LITERAL = sys.intern('``')
+_EMPHASIS = sys.intern('*')
+_COMMA = sys.intern(', ')
+
+# object types whose signatures are rendered in bold rather than literal
+_STRONG_OBJTYPES = frozenset(('class', 'exception', 'method', 'function'))
+
+# length of the head and tail kept when shortening long annotations
+_DESC_ANNOTATION_H = MAXWIDTH // 3
+
+def _render_table(rows, widths, separator, nl):
+    """Render a grid table.
+
+    *rows* is a list of rows, each a list of cells given as lists of
+    already wrapped lines; *widths* are the final column widths.  The
+    header border ``=`` is drawn above row number *separator* (no header
+    if it is 0).  Returns the table text with every line terminated by
+    *nl*.
+    """
+    def makesep(char='-'):
+        return '+%s+%s' % ('+'.join(char * (width+2)
+                                    for width in widths), nl)
+
+    # the column widths are final at this point, so every border
+    # line of the table is the same; build them only once
+    border = makesep('-')
+    head_border = makesep('=')
+
+    out = []
+    for i, row in enumerate(rows):
+        if separator and i == separator:
+            out.append(head_border)
+        else:
+            out.append(border)
+        for line in zip(*row):
+            # no cell line is wider than its column, so ljust() pads
+            # every cell (empty ones included) to exactly its width
+            out.append('| %s |%s' % (' | '.join(cell.ljust(width)
+                                                for cell, width
+                                                in zip(line, widths)), nl))
+    out.append(border)
+    return ''.join(out)
+
 
 class RstWriter(writers.Writer):
     supported = ('text',)
@@ -45,6 +90,9 @@ class RstTranslator(TextTranslator):
 
     def __init__(self, document, builder):
         TextTranslator.__init__(self, document, builder)
+        # replaced by _frames below; drop the base class stacks so that
+        # code still using them fails instead of losing output
+        del self.states, self.stateindent
 
         newlines = builder.config.text_newlines
         if newlines == 'windows':
@@ -53,17 +101,23 @@ class RstTranslator(TextTranslator):
             self.nl = os.linesep
         else:
             self.nl = '\n'
-        self.sectionchars = builder.config.text_sectionchars
-        self.states = [[]]
-        self.stateindent = [0]
+        self.sectionchars = tuple(builder.config.text_sectionchars)
+        # underline character of each open section, innermost last
+        self._title_char_stack = []
+        # stack of (indent, content) states; _total_indent is the sum
+        # of all indents on the stack
+        self._frames = [(0, [])]
+        self._total_indent = 0
         self.list_counter = []
         self.sectionlevel = 0
         self.table = None
+        self._in_table = False
         if self.builder.config.rst_indent:
             self.indent = self.builder.config.rst_indent
         else:
             self.indent = STDINDENT
-        self.wrapper = textwrap.TextWrapper(width=STDINDENT, break_long_words=False, break_on_hyphens=False)
+        # TextWrapper instances keyed by width, see wrap()
+        self._wrappers = {}
 
     def log_unknown(self, type, node):
         if len(_log.handlers) == 0:
@@ -73,22 +127,36 @@ class RstTranslator(TextTranslator):
         _log.warning("%s(%s) unsupported formatting" % (type, node))
 
     def wrap(self, text, width=STDINDENT):
-        self.wrapper.width = width
-        return self.wrapper.wrap(text)
+        # Text that already fits on one line and has no whitespace the
+        # wrapper would replace or drop comes back unchanged.
+        if 0 < len(text) <= width and text.isprintable() and \
+                text == text.strip():
+            return [text]
+        wrapper = self._wrappers.get(width)
+        if wrapper is None:
+            wrapper = self._wrappers[width] = textwrap.TextWrapper(
+                width=width, break_long_words=False, break_on_hyphens=False)
+        return wrapper.wrap(text)
 
     def add_text(self, text):
-        self.states[-1].append((-1, text))
+        self._frames[-1][1].append((-1, text))
 
     def new_state(self, indent=STDINDENT):
-        _log.debug("new_state %s", inspect.stack()[1][3])
-        self.states.append([])
-        self.stateindent.append(indent)
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug("new_state %s", sys._getframe(1).f_code.co_name)
+        self._frames.append((indent, []))
+        self._total_indent += indent
+
+    def _pop_state(self):
+        indent, content = self._frames.pop()
+        self._total_indent -= indent
+        return indent, content
 
     def end_state(self, wrap=False, end=[''], first=None):
-        _log.debug("end state %s", inspect.stack()[1][3])
-        content = self.states.pop()
-        maxindent = sum(self.stateindent)
-        indent = self.stateindent.pop()
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug("end state %s", sys._getframe(1).f_code.co_name)
+        maxindent = self._total_indent
+        indent, content = self._pop_state()
         result = []
         toformat = []
         def do_format():
@@ -115,25 +183,33 @@ class RstTranslator(TextTranslator):
                 result.insert(0, (itemindent - indent, [first + item[0]]))
                 result[1] = (itemindent, item[1:])
 
-        self.states[-1].extend(result)
+        self._frames[-1][1].extend(result)
 
     def visit_document(self, node):
         self.new_state(0)
     def depart_document(self, node):
         self.end_state()
-        self.body = self.nl.join(line and (' '*indent + line)
-                                 for indent, lines in self.states[0]
-                                 for line in lines)
+        parts = []
+        append = parts.append
+        indent_cache = {}
+        for indent, lines in self._frames[0][1]:
+            pad = indent_cache.get(indent)
+            if pad is None:
+                pad = indent_cache[indent] = ' ' * indent
+            for line in lines:
+                append(pad + line if line else '')
+        self.body = self.nl.join(parts)
         # TODO: add header/footer?
 
     def visit_highlightlang(self, node):
         raise nodes.SkipNode
 
     def visit_section(self, node):
-        self._title_char = self.sectionchars[self.sectionlevel]
+        self._title_char_stack.append(self.sectionchars[self.sectionlevel])
         self.sectionlevel += 1
     def depart_section(self, node):
         self.sectionlevel -= 1
+        self._title_char_stack.pop()
 
     def visit_topic(self, node):
         self.new_state(0)
@@ -169,12 +245,11 @@ class RstTranslator(TextTranslator):
         self.new_state(0)
     def depart_title(self, node):
         if isinstance(node.parent, nodes.section):
-            char = self._title_char
+            char = self._title_char_stack[-1]
         else:
             char = '^'
-        text = ''.join(x[1] for x in self.states.pop() if x[0] == -1)
-        self.stateindent.pop()
-        self.states[-1].append((0, ['', text, '%s' % (char * len(text)), '']))
+        text = ''.join(x[1] for x in self._pop_state()[1] if x[0] == -1)
+        self._frames[-1][1].append((0, ['', text, '%s' % (char * len(text)), '']))
 
     def visit_subtitle(self, node):
         # self.log_unknown("subtitle", node)
@@ -193,15 +268,16 @@ class RstTranslator(TextTranslator):
         self.end_state()
 
     def visit_desc_signature(self, node):
-        if node.parent['objtype'] in ('class', 'exception', 'method', 'function'):
-            self.add_text('**')
+        node._rst_strong = node.parent['objtype'] in _STRONG_OBJTYPES
+        if node._rst_strong:
+            self.add_text(_STRONG)
         else:
-            self.add_text('``')
+            self.add_text(_LITERAL)
     def depart_desc_signature(self, node):
-        if node.parent['objtype'] in ('class', 'exception', 'method', 'function'):
-            self.add_text('**')
+        if node._rst_strong:
+            self.add_text(_STRONG)
         else:
-            self.add_text('``')
+            self.add_text(_LITERAL)
 
     def visit_desc_name(self, node):
         self.add_text(node.rawsource)
@@ -234,7 +310,7 @@ class RstTranslator(TextTranslator):
 
     def visit_desc_parameter(self, node):
         if not self.first_param:
-            self.add_text(', ')
+            self.add_text(_COMMA)
         else:
             self.first_param = 0
         self.add_text(node.astext())
@@ -248,9 +324,8 @@ class RstTranslator(TextTranslator):
     def visit_desc_annotation(self, node):
         content = node.astext()
         if len(content) > MAXWIDTH:
-            h = int(MAXWIDTH/3)
-            content = content[:h] + " ... " + content[-h:]
-            self.add_text(content)
+            self.add_text(content[:_DESC_ANNOTATION_H] + " ... " +
+                          content[-_DESC_ANNOTATION_H:])
             raise nodes.SkipNode
     def depart_desc_annotation(self, node):
         pass
@@ -278,17 +353,18 @@ class RstTranslator(TextTranslator):
 
     def visit_productionlist(self, node):
         self.new_state(self.indent)
-        names = []
-        for production in node:
-            names.append(production['tokenname'])
-        maxlen = max(len(name) for name in names)
-        for production in node:
-            if production['tokenname']:
-                self.add_text(production['tokenname'].ljust(maxlen) + ' ::=')
-                lastname = production['tokenname']
+        names = [production['tokenname'] for production in node]
+        maxlen = max(map(len, names))
+        lines = []
+        for name, production in zip(names, node):
+            if name:
+                lines.append('%s ::=%s' % (name.ljust(maxlen),
+                                           production.astext()))
+                lastname = name
             else:
-                self.add_text('%s    ' % (' '*len(lastname)))
-            self.add_text(production.astext() + self.nl)
+                lines.append('%s    %s' % (' '*len(lastname),
+                                           production.astext()))
+        self.add_text(''.join(line + self.nl for line in lines))
         self.end_state(wrap=False)
         raise nodes.SkipNode
 
@@ -337,7 +413,7 @@ class RstTranslator(TextTranslator):
         if self._firstoption:
             self._firstoption = False
         else:
-            self.add_text(', ')
+            self.add_text(_COMMA)
     def depart_option(self, node):
         pass
 
@@ -378,7 +454,8 @@ class RstTranslator(TextTranslator):
         pass
 
     def visit_tbody(self, node):
-        self.table.append('sep')
+        # number of rows before the body, i.e. where the header border goes
+        self._table_separator = len(self.table) - 1
     def depart_tbody(self, node):
         pass
 
@@ -393,64 +470,47 @@ class RstTranslator(TextTranslator):
                                       'not implemented.')
         self.new_state(0)
     def depart_entry(self, node):
-        text = self.nl.join(self.nl.join(x[1]) for x in self.states.pop())
-        self.stateindent.pop()
+        lines = []
+        inline = []
+        for indent, item in self._pop_state()[1]:
+            if indent == -1:
+                # inline text not wrapped in a paragraph
+                inline.append(item)
+            else:
+                if inline:
+                    lines.append(''.join(inline))
+                    inline = []
+                lines.extend(item)
+        if inline:
+            lines.append(''.join(inline))
+        text = self.nl.join(lines)
         self.table[-1].append(text)
 
     def visit_table(self, node):
-        if self.table:
+        if self._in_table:
             raise NotImplementedError('Nested tables are not supported.')
+        self._in_table = True
         self.new_state(0)
         self.table = [[]]
+        self._table_separator = 0
     def depart_table(self, node):
-        lines = self.table[1:]
         fmted_rows = []
         colwidths = self.table[0]
         realwidths = colwidths[:]
-        separator = 0
         # don't allow paragraphs in table cells for now
-        for line in lines:
-            if line == 'sep':
-                separator = len(fmted_rows)
-            else:
-                cells = []
-                for i, cell in enumerate(line):
-                    par = self.wrap(cell, width=colwidths[i])
-                    if par:
-                        maxwidth = max(list(map(len, par)))
-                    else:
-                        maxwidth = 0
-                    realwidths[i] = max(realwidths[i], maxwidth)
-                    cells.append(par)
-                fmted_rows.append(cells)
-
-        def writesep(char='-'):
-            out = ['+']
-            for width in realwidths:
-                out.append(char * (width+2))
-                out.append('+')
-            self.add_text(''.join(out) + self.nl)
-
-        def writerow(row):
-            lines = list(zip(*row))
-            for line in lines:
-                out = ['|']
-                for i, cell in enumerate(line):
-                    if cell:
-                        out.append(' ' + cell.ljust(realwidths[i]+1))
-                    else:
-                        out.append(' ' * (realwidths[i] + 2))
-                    out.append('|')
-                self.add_text(''.join(out) + self.nl)
-
-        for i, row in enumerate(fmted_rows):
-            if separator and i == separator:
-                writesep('=')
-            else:
-                writesep('-')
-            writerow(row)
-        writesep('-')
+        for line in itertools.islice(self.table, 1, None):
+            cells = []
+            for i, cell in enumerate(line):
+                par = self.wrap(cell, width=colwidths[i])
+                if par:
+                    realwidths[i] = max(realwidths[i], max(map(len, par)))
+                cells.append(par)
+            fmted_rows.append(cells)
+
+        self.add_text(_render_table(fmted_rows, realwidths,
+                                    self._table_separator, self.nl))
         self.table = None
+        self._in_table = False
         self.end_state(wrap=False)
 
     def visit_acks(self, node):
@@ -467,7 +527,7 @@ class RstTranslator(TextTranslator):
         raise nodes.SkipNode
 
     def visit_transition(self, node):
-        indent = sum(self.stateindent)
+        indent = self._total_indent
         self.new_state(0)
         self.add_text('=' * (MAXWIDTH - indent))
         self.end_state()
@@ -520,7 +580,7 @@ class RstTranslator(TextTranslator):
             self.end_state(end=None)
 
     def visit_termsep(self, node):
-        self.add_text(', ')
+        self.add_text(_COMMA)
         raise nodes.SkipNode
 
     def visit_classifier(self, node):
@@ -547,9 +607,7 @@ class RstTranslator(TextTranslator):
     def visit_field_name(self, node):
         self.add_text(':')
     def depart_field_name(self, node):
-        self.add_text(':')
-        content = node.astext()
-        self.add_text((16-len(content))*' ')
+        self.add_text(':' + (16 - len(node.astext())) * ' ')
 
     def visit_field_body(self, node):
         self.new_state(self.indent)
@@ -578,31 +636,31 @@ class RstTranslator(TextTranslator):
     def depart_admonition(self, node):
         self.end_state()
 
+    # admonitionlabels key for each specific admonition node class
+    _ADMON_LABELS = {
+        nodes.attention: 'attention',
+        nodes.caution: 'caution',
+        nodes.danger: 'danger',
+        nodes.error: 'error',
+        nodes.hint: 'hint',
+        nodes.important: 'important',
+        nodes.note: 'note',
+        nodes.tip: 'tip',
+        nodes.warning: 'warning',
+    }
+
     def _visit_admonition(self, node):
         self.new_state(self.indent)
-    def _make_depart_admonition(name):
-        def depart_admonition(self, node):
-            self.end_state(first=admonitionlabels[name] + ': ')
-        return depart_admonition
-
-    visit_attention = _visit_admonition
-    depart_attention = _make_depart_admonition('attention')
-    visit_caution = _visit_admonition
-    depart_caution = _make_depart_admonition('caution')
-    visit_danger = _visit_admonition
-    depart_danger = _make_depart_admonition('danger')
-    visit_error = _visit_admonition
-    depart_error = _make_depart_admonition('error')
-    visit_hint = _visit_admonition
-    depart_hint = _make_depart_admonition('hint')
-    visit_important = _visit_admonition
-    depart_important = _make_depart_admonition('important')
-    visit_note = _visit_admonition
-    depart_note = _make_depart_admonition('note')
-    visit_tip = _visit_admonition
-    depart_tip = _make_depart_admonition('tip')
-    visit_warning = _visit_admonition
-    depart_warning = _make_depart_admonition('warning')
+    def _depart_admonition(self, node):
+        label = admonitionlabels[self._ADMON_LABELS[type(node)]]
+        self.end_state(first=label + ': ')
+
+    visit_attention = visit_caution = visit_danger = visit_error = \
+        visit_hint = visit_important = visit_note = visit_tip = \
+        visit_warning = _visit_admonition
+    depart_attention = depart_caution = depart_danger = depart_error = \
+        depart_hint = depart_important = depart_note = depart_tip = \
+        depart_warning = _depart_admonition
 
     def visit_versionmodified(self, node):
         self.new_state(0)
@@ -660,12 +718,14 @@ class RstTranslator(TextTranslator):
         pass
 
     def visit_paragraph(self, node):
-        if not isinstance(node.parent, nodes.Admonition) or \
-               isinstance(node.parent, addnodes.seealso):
+        # paragraphs directly inside an admonition share its state;
+        # remember the decision for depart_paragraph()
+        node._rst_skip_state = isinstance(node.parent, nodes.Admonition) and \
+            not isinstance(node.parent, addnodes.seealso)
+        if not node._rst_skip_state:
             self.new_state(0)
     def depart_paragraph(self, node):
-        if not isinstance(node.parent, nodes.Admonition) or \
-               isinstance(node.parent, addnodes.seealso):
+        if not node._rst_skip_state:
             self.end_state()
 
     def visit_target(self, node):
@@ -763,19 +823,19 @@ class RstTranslator(TextTranslator):
         pass
 
     def visit_emphasis(self, node):
-        self.add_text('*')
+        self.add_text(_EMPHASIS)
     def depart_emphasis(self, node):
-        self.add_text('*')
+        self.add_text(_EMPHASIS)
 
     def visit_literal_emphasis(self, node):
-        self.add_text('*')
+        self.add_text(_EMPHASIS)
     def depart_literal_emphasis(self, node):
-        self.add_text('*')
+        self.add_text(_EMPHASIS)
 
     def visit_strong(self, node):
-        self.add_text('**')
+        self.add_text(_STRONG)
     def depart_strong(self, node):
-        self.add_text('**')
+        self.add_text(_STRONG)
 
     def visit_abbreviation(self, node):
         self.add_text('')
@@ -785,14 +845,14 @@ class RstTranslator(TextTranslator):
 
     def visit_title_reference(self, node):
         # self.log_unknown("title_reference", node)
-        self.add_text('*')
+        self.add_text(_EMPHASIS)
     def depart_title_reference(self, node):
-        self.add_text('*')
+        self.add_text(_EMPHASIS)
 
     def visit_literal(self, node):
-        self.add_text('``')
+        self.add_text(_LITERAL)
     def depart_literal(self, node):
-        self.add_text('``')
+        self.add_text(_LITERAL)
 
     def visit_subscript(self, node):
         self.add_text('_')